@@ -1,79 +1,397 @@
 import os
+import re
 import json
-from typing import Optional, Dict, Any, List
-
+import asyncio
+import hashlib
+import random
+import threading
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, TypedDict
+
+import pyarrow as pa
 import streamlit as st
-from openai import OpenAI
+
+import cache
+
+# The OpenAI SDK (and its httpx/pydantic machinery) is imported lazily
+# inside get_client()/the call wrapper: Streamlit re-executes this script
+# on every widget interaction, and reruns that never reach a search
+# shouldn't pay the SDK import.
+
+# orjson handles the multi-KB model responses a few times faster than
+# stdlib json; fall back silently if it is not installed.
+try:
+    import orjson
+
+    def json_loads(s):
+        return orjson.loads(s)
+
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
 
 
 # ============= CONFIG & CLIENT ============= #
 
+@st.cache_resource
+def page_icon() -> Optional[str]:
+    """Stat logo.png once per process instead of on every rerun."""
+    return "logo.png" if os.path.exists("logo.png") else None
+
+
 # Page config must come before other Streamlit calls
 st.set_page_config(
     page_title="Boots to Beats",
-    page_icon="logo.png",  # logo.png in the same folder as app.py
+    page_icon=page_icon(),  # logo.png in the same folder as app.py
     layout="centered",
 )
 
-# Read API key from env or Streamlit secrets
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or (
-    st.secrets["OPENAI_API_KEY"] if "OPENAI_API_KEY" in st.secrets else None
-)
+def load_api_key() -> Optional[str]:
+    """Read the API key from env or Streamlit secrets."""
+    # Single .get instead of `in` + indexing: the secrets store parses
+    # secrets.toml lazily, so this touches it once, and returns None
+    # cleanly when no secrets file exists.
+    return os.getenv("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY")
+
+
+@st.cache_resource
+def get_client() -> "AsyncOpenAI":  # noqa: F821 - imported lazily below
+    """
+    Build the OpenAI client exactly once per server process.
+
+    The SDK import happens here, inside the cached factory, so reruns
+    only pay for it the first time. The explicit HTTP/2 transport keeps
+    connections alive between calls (no fresh DNS/TCP/TLS handshake per
+    click) and multiplexes concurrent variant requests over one
+    connection.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        timeout=httpx.Timeout(60.0),
+    )
+    return AsyncOpenAI(api_key=load_api_key(), http_client=http_client)
+
+
+@st.cache_resource
+def _async_runtime() -> Tuple[asyncio.AbstractEventLoop, threading.Thread]:
+    """
+    One long-lived event loop on a daemon thread, shared by all searches.
+
+    asyncio.run() spins up and closes a fresh loop per call, which strands
+    the cached client's keep-alive connections on a dead loop: the next
+    search fails its first attempt with "Event loop is closed" (surfaced
+    by the SDK as a retryable connection error) and then redoes the
+    TCP/TLS setup the warm pool exists to avoid. Every coroutine runs on
+    this single loop instead, so the pool stays usable across searches.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="b2b-asyncio", daemon=True)
+    thread.start()
+    return loop, thread
+
+
+def run_async(coro: Any) -> Any:
+    """
+    Run `coro` on the persistent loop and block until it finishes.
 
-if not OPENAI_API_KEY:
+    The current script-run context is attached to the loop thread first
+    so Streamlit calls made from coroutines (the streaming preview)
+    still reach the frontend.
+    """
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    loop, thread = _async_runtime()
+    add_script_run_ctx(thread, get_script_run_ctx())
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+if not load_api_key():
     st.error(
         "OPENAI_API_KEY is not set. Please add it as an environment variable "
         "or in Streamlit Secrets (Settings → Secrets)."
     )
     st.stop()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
 MODEL_NAME = "gpt-4.1-mini"  # adjust if needed
 
+# Legacy A/B escape hatch: set B2B_TWO_CALL_PIPELINE=1 to issue the old
+# separate PART 1 / PART 2 requests instead of the combined single call.
+TWO_CALL_PIPELINE = os.getenv("B2B_TWO_CALL_PIPELINE") == "1"
+
+CONCRETE_LEVELS = ["Beginner", "High Beginner", "Improver", "Intermediate", "Advanced"]
+
+# Cap on simultaneous API calls when fanning out variants, to stay well
+# below OpenAI's per-minute request limits. Overridable per deployment so
+# higher-tier accounts can raise it without a code change.
+MAX_CONCURRENT_CALLS = int(os.getenv("OPENAI_MAX_CONCURRENCY", "5"))
+
+MAX_ATTEMPTS = 3
+
+# Hard ceiling on generated tokens. A full combined answer (song profile
+# plus two groups of five choreographies) fits comfortably; the cap stops
+# runaway "reason" prose from inflating latency and cost, since generation
+# time is linear in output tokens.
+MAX_OUTPUT_TOKENS = int(os.getenv("B2B_MAX_OUTPUT_TOKENS", "2500"))
+
+
+def _retryable_errors() -> tuple:
+    """Transient failures worth retrying; anything else surfaces immediately."""
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+
+    return (APITimeoutError, APIConnectionError, RateLimitError)
+
 
 # ============= SHARED JSON HELPER ============= #
 
+# Compiled once at import; strips a markdown code fence (``` or ```json)
+# wrapping the model output so the fast whole-text JSON parse succeeds
+# without falling back to the brace scanner.
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def strip_code_fence(s: str) -> str:
+    """Remove a surrounding markdown code fence, if any."""
+    return _FENCE_RE.sub("", s)
+
+
 def extract_json_block(s: str) -> str:
     """
-    Extract the first top-level JSON object from a text string.
-    We assume the model returns exactly one object.
+    Extract the first top-level JSON object from a text string in a
+    single pass, tracking brace depth and JSON string state so that
+    braces inside quoted values (e.g. web_search snippets) don't
+    confuse the boundaries. We assume the model returns one object.
     """
-    start = s.find("{")
-    end = s.rfind("}")
-    if start == -1 or end == -1 or end <= start:
-        raise ValueError("No JSON object found in model output.")
-    return s[start: end + 1]
+    # Fast path: a reply that is already a bare object needs no scan.
+    stripped = s.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        return stripped
+
+    start = -1
+    depth = 0
+    in_string = False
+    escaped = False
+
+    for i, c in enumerate(s):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"' and start != -1:
+            in_string = True
+        elif c == "{":
+            if start == -1:
+                start = i
+            depth += 1
+        elif c == "}" and start != -1:
+            depth -= 1
+            if depth == 0:
+                return s[start: i + 1]
+
+    raise ValueError("No JSON object found in model output.")
 
 
 # ============= PROMPTS ============= #
 
+# Prompts are split into a large, byte-identical system part (first, so
+# OpenAI's automatic prompt caching can reuse its KV prefix across calls)
+# and a small per-request user part. The builders only run a single
+# .format() pass over the user template per call.
+_DEDICATED_SYSTEM = """You are Boots to Beats, an expert line dance assistant.
+
+You help dancers figure out which line dance choreographies go with specific songs.
+
+THIS IS PART 1 OF 2. In this part, focus ONLY on line dance choreographies that are
+clearly linked to THIS input song, and provide a short dancer-oriented analysis of the song.
+
+PART 1A – SONG ANALYSIS:
+1. Use web search to determine:
+   - The approximate tempo/BPM of the input song.
+   - The time signature (e.g. 4/4, 3/4).
+   - The main dance style / rhythm (e.g. country cha-cha, nightclub two-step, swing).
+   - A short description of the musical feel (e.g. "relaxed mid-tempo country waltz").
+   - Any commonly referenced social/partner/line-dance styles used with this song.
+2. Summarise this in a compact, dancer-friendly description.
+
+PART 1B – DEDICATED CHOREOGRAPHIES:
+1. Use web search to identify line dances that:
+   - Were choreographed specifically for this song, OR
+   - Are widely recognised in the line dance community as THE standard line dance
+     for this song.
+2. For each suitable choreography, collect:
+   - Name
+   - Estimated level (Beginner, High Beginner, Improver, Intermediate, Advanced)
+   - Region of origin or primary use (if inferable)
+   - At least one reliable step-sheet or tutorial link
+
+QUANTITY RULE FOR THIS PART:
+- If web search indicates that there are at least as many DISTINCT dedicated
+  line dances for this song as the requested number for this group, you MUST
+  return exactly that many choreographies in this group.
+- Only return fewer when, after reasonable searching, you genuinely cannot
+  identify that many distinct dedicated choreographies for this song.
+
+OUTPUT FORMAT (IMPORTANT):
+Return ONLY a single JSON object, no extra text.
+
+The JSON object must have:
+- "song": string (song title)
+- "artist": string (artist name if known)
+- "requested_level": string
+- "requested_region": string
+- "song_info": object
+- "choreographies": array
+
+The "song_info" object must contain:
+- "title": string
+- "artist": string
+- "bpm": number or string (approximate BPM)
+- "tempo_label": string (e.g. "slow", "mid-tempo", "up-tempo")
+- "style": string (e.g. "country cha-cha", "nightclub two-step")
+- "time_signature": string (e.g. "4/4", "3/4")
+- "dance_feel": string, short phrase for dancers
+- "typical_dance_styles": array of strings (e.g. ["line dance", "two-step"])
+- "summary": string (2–3 sentences oriented to dancers)
+- "sources": array of strings (optional, URLs you used)
+
+Each item in "choreographies" must be an object with:
+- "rank": integer (1 = strongest dedicated match)
+- "name": string
+- "estimated_level": string
+- "estimated_region": string
+- "type": string (one of "step_sheet", "tutorial_video", "article", "other")
+- "fit_type": string, MUST be "dedicated_for_song"
+- "url": string (main learning link)
+- "extra_sources": array of strings (optional)
+- "reason": string (why this is a good dedicated match for the song)
+
+The JSON must be syntactically valid (no trailing commas, no comments)."""
+
+_DEDICATED_USER_TEMPLATE = """USER REQUEST:
+- Song: "{song_title}"{artist_part}
+- Requested level: {level}
+- Requested region: {region_part}
+- Requested number of choreographies in this group: {max_results}"""
+
+
+@lru_cache(maxsize=256)
 def build_prompt_dedicated(
     song_title: str,
     artist: Optional[str],
     level: str,
     region: Optional[str],
     max_results: int,
-) -> str:
+) -> Tuple[str, str]:
     """
-    Prompt for PART 1: dedicated choreographies + song_info.
+    (system, user) prompt pair for PART 1: dedicated choreographies + song_info.
     """
     artist_part = f' by "{artist}"' if artist else ""
     region_part = region if region else "any"
 
-    return f"""You are Boots to Beats, an expert line dance assistant.
+    return _DEDICATED_SYSTEM, _DEDICATED_USER_TEMPLATE.format(
+        song_title=song_title,
+        artist_part=artist_part,
+        level=level,
+        region_part=region_part,
+        max_results=max_results,
+    )
+
+
+_BATCH_SYSTEM = """You are Boots to Beats, an expert line dance assistant.
 
 You help dancers figure out which line dance choreographies go with specific songs.
 
-USER REQUEST:
-- Song: "{song_title}"{artist_part}
+The user provides a LIST of songs. For EACH song in the list, do the same work
+as a single-song lookup:
+1. Use web search to determine the song's approximate tempo/BPM, time signature,
+   main dance style/rhythm, and musical feel, and summarise this for dancers.
+2. Use web search to identify line dances choreographed specifically for that
+   song, or widely recognised as THE standard line dance for it, with name,
+   estimated level, region, and at least one reliable step-sheet or tutorial link.
+3. Return up to the requested number of choreographies per song, fewer only
+   when you genuinely cannot identify that many distinct dedicated choreographies.
+
+OUTPUT FORMAT (IMPORTANT):
+Return ONLY a single JSON object, no extra text, shaped as:
+- "results": array with EXACTLY one entry per input song, in input order.
+
+Each entry in "results" must have:
+- "song": string (the input song title)
+- "artist": string (artist name if known)
+- "song_info": object with the same fields as a single-song lookup
+  (title, artist, bpm, tempo_label, style, time_signature, dance_feel,
+  typical_dance_styles, summary, sources)
+- "choreographies": array of objects with the same fields as a single-song
+  lookup (rank, name, estimated_level, estimated_region, type, fit_type
+  "dedicated_for_song", url, extra_sources, reason)
+
+The JSON must be syntactically valid (no trailing commas, no comments)."""
+
+_BATCH_USER_TEMPLATE = """USER REQUEST:
+- Songs (one lookup per song):
+{song_lines}
 - Requested level: {level}
 - Requested region: {region_part}
-- Requested number of choreographies in this group: {max_results}
+- Requested number of choreographies per song: {max_results}"""
 
-THIS IS PART 1 OF 2. In this part, focus ONLY on line dance choreographies that are
-clearly linked to THIS input song, and provide a short dancer-oriented analysis of the song.
 
-PART 1A – SONG ANALYSIS:
+@lru_cache(maxsize=64)
+def build_prompt_batch(
+    songs: tuple,
+    level: str,
+    region: Optional[str],
+    max_results: int,
+) -> Tuple[str, str]:
+    """
+    (system, user) prompt pair for a batched lookup: several songs in ONE
+    request, so the large instruction block is paid once instead of once
+    per song.
+    """
+    region_part = region if region else "any"
+    song_lines = "\n".join(f'  {i + 1}. "{s}"' for i, s in enumerate(songs))
+
+    return _BATCH_SYSTEM, _BATCH_USER_TEMPLATE.format(
+        song_lines=song_lines,
+        level=level,
+        region_part=region_part,
+        max_results=max_results,
+    )
+
+
+def summarize_song_info(song_info: Optional[Dict[str, Any]]) -> str:
+    """Compact one-line musical profile of the song, for the PART 2 prompt."""
+    if not song_info:
+        return ""
+    bpm = song_info.get("bpm")
+    style = song_info.get("style")
+    tempo_label = song_info.get("tempo_label")
+    summary_text = song_info.get("summary") or ""
+    meta_bits = []
+    if bpm:
+        meta_bits.append(f"≈{bpm} BPM")
+    if tempo_label:
+        meta_bits.append(str(tempo_label))
+    if style:
+        meta_bits.append(str(style))
+    meta_line = ", ".join(meta_bits)
+    return f"Approximate musical profile: {meta_line}. Summary: {summary_text}"
+
+
+_COMBINED_SYSTEM = """You are Boots to Beats, an expert line dance assistant.
+
+You help dancers figure out which line dance choreographies go with specific songs.
+Answer the user's whole request in ONE response, in three parts.
+
+PART A – SONG ANALYSIS:
 1. Use web search to determine:
    - The approximate tempo/BPM of the input song.
    - The time signature (e.g. 4/4, 3/4).
@@ -82,7 +400,7 @@ PART 1A – SONG ANALYSIS:
    - Any commonly referenced social/partner/line-dance styles used with this song.
 2. Summarise this in a compact, dancer-friendly description.
 
-PART 1B – DEDICATED CHOREOGRAPHIES:
+PART B – DEDICATED CHOREOGRAPHIES:
 1. Use web search to identify line dances that:
    - Were choreographed specifically for this song, OR
    - Are widely recognised in the line dance community as THE standard line dance
@@ -93,12 +411,23 @@ PART 1B – DEDICATED CHOREOGRAPHIES:
    - Region of origin or primary use (if inferable)
    - At least one reliable step-sheet or tutorial link
 
-QUANTITY RULE FOR THIS PART:
-- If web search indicates that there are at least {max_results} DISTINCT dedicated
-  line dances for this song, you MUST return exactly {max_results} choreographies
-  in this group.
-- Only return fewer than {max_results} when, after reasonable searching, you genuinely
-  cannot identify that many distinct dedicated choreographies for this song.
+PART C – COMPATIBLE CHOREOGRAPHIES FROM OTHER SONGS:
+1. Use web search to identify popular line dances whose ORIGINAL music has:
+   - Tempo/BPM similar to the input song.
+   - Compatible rhythm and style (e.g. similar cha-cha / waltz / two-step / swing feel).
+2. These dances do NOT have to mention the input song at all.
+3. They should be realistic alternate choices for a DJ or instructor to use when
+   this input song is playing.
+4. For each choreography, clearly describe in "reason":
+   - The original song and approximate BPM/style.
+   - Why that makes it a good musical match for the input song.
+
+QUANTITY RULE (applies to PART B and PART C separately):
+- If web search indicates that there are at least as many DISTINCT suitable
+  choreographies in a group as the requested number, you MUST return exactly
+  that many choreographies in that group.
+- Only return fewer when, after reasonable searching, you genuinely cannot
+  identify that many distinct suitable entries.
 
 OUTPUT FORMAT (IMPORTANT):
 Return ONLY a single JSON object, no extra text.
@@ -109,7 +438,8 @@ The JSON object must have:
 - "requested_level": string
 - "requested_region": string
 - "song_info": object
-- "choreographies": array
+- "dedicated_choreographies": array (PART B results)
+- "compatible_choreographies": array (PART C results)
 
 The "song_info" object must contain:
 - "title": string
@@ -123,64 +453,48 @@ The "song_info" object must contain:
 - "summary": string (2–3 sentences oriented to dancers)
 - "sources": array of strings (optional, URLs you used)
 
-Each item in "choreographies" must be an object with:
-- "rank": integer (1 = strongest dedicated match)
+Each item in both choreography arrays must be an object with:
+- "rank": integer (1 = strongest match within its group)
 - "name": string
 - "estimated_level": string
 - "estimated_region": string
 - "type": string (one of "step_sheet", "tutorial_video", "article", "other")
-- "fit_type": string, MUST be "dedicated_for_song"
+- "fit_type": string, "dedicated_for_song" in "dedicated_choreographies"
+  and "compatible_generic" in "compatible_choreographies"
 - "url": string (main learning link)
 - "extra_sources": array of strings (optional)
-- "reason": string (why this is a good dedicated match for the song)
+- "reason": string (why this entry fits)
 
 The JSON must be syntactically valid (no trailing commas, no comments)."""
 
 
-def build_prompt_generic(
+@lru_cache(maxsize=256)
+def build_prompt_combined(
     song_title: str,
     artist: Optional[str],
     level: str,
     region: Optional[str],
     max_results: int,
-    song_info: Optional[Dict[str, Any]],
-) -> str:
+) -> Tuple[str, str]:
     """
-    Prompt for PART 2: ONLY choreographies from OTHER songs,
-    but musically compatible with the input song.
+    (system, user) prompt pair covering both groups in ONE request: one
+    network round-trip and one web_search warm-up instead of two.
     """
     artist_part = f' by "{artist}"' if artist else ""
     region_part = region if region else "any"
 
-    # Provide a short inline summary of song_info to guide the model
-    song_info_summary = ""
-    if song_info:
-        bpm = song_info.get("bpm")
-        style = song_info.get("style")
-        tempo_label = song_info.get("tempo_label")
-        summary_text = song_info.get("summary") or ""
-        meta_bits = []
-        if bpm:
-            meta_bits.append(f"≈{bpm} BPM")
-        if tempo_label:
-            meta_bits.append(str(tempo_label))
-        if style:
-            meta_bits.append(str(style))
-        meta_line = ", ".join(meta_bits)
-        song_info_summary = f"Approximate musical profile: {meta_line}. Summary: {summary_text}"
-
-    return f"""You are Boots to Beats, an expert line dance assistant.
+    return _COMBINED_SYSTEM, _DEDICATED_USER_TEMPLATE.format(
+        song_title=song_title,
+        artist_part=artist_part,
+        level=level,
+        region_part=region_part,
+        max_results=max_results,
+    )
 
-This is PART 2 OF 2 for the same user query.
 
-The user asked for line dance choreographies for:
-- Song: "{song_title}"{artist_part}
-- Requested level: {level}
-- Requested region: {region_part}
-- Requested number of choreographies in this group: {max_results}
+_GENERIC_SYSTEM = """You are Boots to Beats, an expert line dance assistant.
 
-SONG PROFILE (approximate, from previous analysis):
-{song_info_summary}
+This is PART 2 OF 2 for the same user query.
 
 YOUR TASK IN THIS PART:
 Focus ONLY on line dance choreographies that were originally created for OTHER songs,
@@ -197,11 +511,11 @@ but which are musically compatible with this input song.
    - Why that makes it a good musical match for the input song.
 
 QUANTITY RULE FOR THIS PART:
-- If web search indicates that there are at least {max_results} DISTINCT suitable
-  alternate choreographies (for other songs), you MUST return exactly {max_results}
-  choreographies in this group.
-- Only return fewer than {max_results} when, after reasonable searching, you genuinely
-  cannot identify that many distinct suitable alternates.
+- If web search indicates that there are at least as many DISTINCT suitable
+  alternate choreographies (for other songs) as the requested number for this
+  group, you MUST return exactly that many choreographies in this group.
+- Only return fewer when, after reasonable searching, you genuinely cannot
+  identify that many distinct suitable alternates.
 
 OUTPUT FORMAT (IMPORTANT):
 Return ONLY a single JSON object, no extra text.
@@ -228,85 +542,660 @@ Each item in "choreographies" must be an object with:
 
 The JSON must be syntactically valid (no trailing commas, no comments)."""
 
+_GENERIC_USER_TEMPLATE = """The user asked for line dance choreographies for:
+- Song: "{song_title}"{artist_part}
+- Requested level: {level}
+- Requested region: {region_part}
+- Requested number of choreographies in this group: {max_results}
+
+SONG PROFILE (approximate, from previous analysis):
+{song_info_summary}"""
+
+
+@lru_cache(maxsize=256)
+def build_prompt_generic(
+    song_title: str,
+    artist: Optional[str],
+    level: str,
+    region: Optional[str],
+    max_results: int,
+    song_info_summary: str,
+) -> Tuple[str, str]:
+    """
+    (system, user) prompt pair for PART 2: ONLY choreographies from OTHER
+    songs, but musically compatible with the input song.
+    """
+    artist_part = f' by "{artist}"' if artist else ""
+    region_part = region if region else "any"
+
+    return _GENERIC_SYSTEM, _GENERIC_USER_TEMPLATE.format(
+        song_title=song_title,
+        artist_part=artist_part,
+        level=level,
+        region_part=region_part,
+        max_results=max_results,
+        song_info_summary=song_info_summary,
+    )
+
+
+# ============= RESPONSE SCHEMAS ============= #
+
+# Strict JSON Schemas for the Responses API structured-output mode. The
+# server's constrained decoder guarantees parseable output, so the
+# brace-scanning extraction becomes a fallback rather than the main path.
+
+def _choreo_schema(fit_type: str) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "rank": {"type": "integer"},
+            "name": {"type": "string"},
+            "estimated_level": {"type": "string"},
+            "estimated_region": {"type": "string"},
+            "type": {
+                "type": "string",
+                "enum": ["step_sheet", "tutorial_video", "article", "other"],
+            },
+            "fit_type": {"type": "string", "enum": [fit_type]},
+            "url": {"type": "string"},
+            "extra_sources": {"type": "array", "items": {"type": "string"}},
+            "reason": {"type": "string"},
+        },
+        "required": [
+            "rank", "name", "estimated_level", "estimated_region",
+            "type", "fit_type", "url", "extra_sources", "reason",
+        ],
+        "additionalProperties": False,
+    }
+
+
+_SONG_INFO_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "artist": {"type": "string"},
+        "bpm": {"type": ["number", "string"]},
+        "tempo_label": {"type": "string"},
+        "style": {"type": "string"},
+        "time_signature": {"type": "string"},
+        "dance_feel": {"type": "string"},
+        "typical_dance_styles": {"type": "array", "items": {"type": "string"}},
+        "summary": {"type": "string"},
+        "sources": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": [
+        "title", "artist", "bpm", "tempo_label", "style", "time_signature",
+        "dance_feel", "typical_dance_styles", "summary", "sources",
+    ],
+    "additionalProperties": False,
+}
+
+_DEDICATED_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "song": {"type": "string"},
+        "artist": {"type": "string"},
+        "requested_level": {"type": "string"},
+        "requested_region": {"type": "string"},
+        "song_info": _SONG_INFO_SCHEMA,
+        "choreographies": {
+            "type": "array",
+            "items": _choreo_schema("dedicated_for_song"),
+        },
+    },
+    "required": [
+        "song", "artist", "requested_level", "requested_region",
+        "song_info", "choreographies",
+    ],
+    "additionalProperties": False,
+}
+
+_GENERIC_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "song": {"type": "string"},
+        "artist": {"type": "string"},
+        "requested_level": {"type": "string"},
+        "requested_region": {"type": "string"},
+        "choreographies": {
+            "type": "array",
+            "items": _choreo_schema("compatible_generic"),
+        },
+    },
+    "required": [
+        "song", "artist", "requested_level", "requested_region", "choreographies",
+    ],
+    "additionalProperties": False,
+}
+
+_COMBINED_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "song": {"type": "string"},
+        "artist": {"type": "string"},
+        "requested_level": {"type": "string"},
+        "requested_region": {"type": "string"},
+        "song_info": _SONG_INFO_SCHEMA,
+        "dedicated_choreographies": {
+            "type": "array",
+            "items": _choreo_schema("dedicated_for_song"),
+        },
+        "compatible_choreographies": {
+            "type": "array",
+            "items": _choreo_schema("compatible_generic"),
+        },
+    },
+    "required": [
+        "song", "artist", "requested_level", "requested_region",
+        "song_info", "dedicated_choreographies", "compatible_choreographies",
+    ],
+    "additionalProperties": False,
+}
+
+_BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "song": {"type": "string"},
+                    "artist": {"type": "string"},
+                    "song_info": _SONG_INFO_SCHEMA,
+                    "choreographies": {
+                        "type": "array",
+                        "items": _choreo_schema("dedicated_for_song"),
+                    },
+                },
+                "required": ["song", "artist", "song_info", "choreographies"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["results"],
+    "additionalProperties": False,
+}
+
 
 # ============= OPENAI CALL WRAPPER ============= #
 
-def call_model_with_web_search(prompt: str) -> Dict[str, Any]:
+def make_cache_key(*parts: Any) -> str:
+    """
+    Build a deterministic cache key from the request parameters.
+
+    Free-text parts (song title, artist) are normalized first so that
+    near-duplicate spellings share one cache entry.
+    """
+    normalized = [
+        cache.normalize(p) if isinstance(p, str) else p for p in parts
+    ]
+    payload = json_dumps([MODEL_NAME, *normalized])
+    return hashlib.blake2b(payload.encode()).hexdigest()
+
+
+def dedupe_source_urls(data: Any) -> None:
+    """
+    Drop duplicate URLs from `song_info.sources` and each choreography's
+    `extra_sources`, in place and order-preserving.
+
+    web_search citations frequently overlap, and deduplicating before the
+    answer is cached keeps every cached entry (and every rendered link
+    list) smaller.
+    """
+    if not isinstance(data, dict):
+        return
+
+    song_info = data.get("song_info")
+    if isinstance(song_info, dict) and isinstance(song_info.get("sources"), list):
+        song_info["sources"] = list(dict.fromkeys(song_info["sources"]))
+
+    choreo_lists = [
+        data.get("choreographies"),
+        data.get("dedicated_choreographies"),
+        data.get("compatible_choreographies"),
+    ]
+    for entry in data.get("results", []) if isinstance(data.get("results"), list) else []:
+        if isinstance(entry, dict):
+            dedupe_source_urls(entry)
+    for choreos in choreo_lists:
+        if not isinstance(choreos, list):
+            continue
+        for ch in choreos:
+            if isinstance(ch, dict) and isinstance(ch.get("extra_sources"), list):
+                ch["extra_sources"] = list(dict.fromkeys(ch["extra_sources"]))
+
+
+async def call_model_with_web_search(
+    prompt: Tuple[str, str],
+    cache_key: Optional[str] = None,
+    on_delta: Optional[Any] = None,
+    schema: Optional[Dict[str, Any]] = None,
+    refresh: bool = False,
+) -> Dict[str, Any]:
     """
     Call the OpenAI Responses API with web_search tool and parse JSON output if possible.
     If parsing fails (no JSON), return a dict with '_raw_text' containing the full text.
-    """
-    response = client.responses.create(
-        model=MODEL_NAME,
-        input=prompt,
-        tools=[{"type": "web_search"}],
-    )
 
-    # Try the helper if available
-    try:
-        text = response.output_text
-    except Exception:
-        # Fallback: manually collect text parts
+    `prompt` is a (system, user) pair; the constant system part goes first
+    so the provider's prompt caching can reuse it across requests.
+
+    When `cache_key` is given, a previously stored answer for the same
+    parameters is returned directly, skipping the API call entirely;
+    `refresh=True` skips that lookup but still stores the fresh answer.
+
+    When `on_delta` is given, the output is streamed and `on_delta` is
+    called with the accumulated text after each chunk, so the UI can show
+    progress instead of a blank spinner for the whole call.
+    """
+    if cache_key and not refresh:
+        hit = cache.get(cache_key)
+        if hit is not None:
+            return json_loads(hit)
+
+    system_part, user_part = prompt
+    request_kwargs: Dict[str, Any] = {}
+    if schema is not None:
+        # Constrained decoding on the server guarantees output matching
+        # the schema, so no client-side extraction is needed on this path.
+        request_kwargs["text"] = {
+            "format": {
+                "type": "json_schema",
+                "name": "boots_to_beats",
+                "schema": schema,
+                "strict": True,
+            }
+        }
+
+    # cache_resource hands back the same client (and warm pool) each time
+    client = get_client()
+
+    async def attempt_stream():
         parts: List[str] = []
+        async with client.responses.stream(
+            model=MODEL_NAME,
+            input=[
+                {"role": "system", "content": system_part},
+                {"role": "user", "content": user_part},
+            ],
+            tools=[{"type": "web_search"}],
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+            **request_kwargs,
+        ) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    parts.append(event.delta)
+                    # Repaint every few chunks, not per token: each call
+                    # is a backend->frontend round-trip.
+                    if on_delta and len(parts) % 8 == 0:
+                        on_delta("".join(parts))
+            if on_delta and parts:
+                on_delta("".join(parts))
+            return parts, await stream.get_final_response()
+
+    # Bounded retry with exponential backoff + jitter caps the perceived
+    # tail latency of transient timeouts/disconnects/rate limits.
+    for attempt_no in range(MAX_ATTEMPTS):
         try:
-            for item in response.output:
-                for content in getattr(item, "content", []):
-                    if hasattr(content, "text") and content.text is not None:
-                        parts.append(content.text)
-        except Exception:
+            text_parts, response = await attempt_stream()
+            break
+        except _retryable_errors() as exc:
+            if attempt_no == MAX_ATTEMPTS - 1:
+                raise
+            # On 429s the server says exactly how long to wait; trust it
+            # over the generic backoff when present.
+            headers = getattr(getattr(exc, "response", None), "headers", None)
+            retry_after = headers.get("retry-after") if headers else None
+            try:
+                delay = min(30.0, float(retry_after))
+            except (TypeError, ValueError):
+                delay = min(8.0, 2 ** attempt_no * (0.5 + random.random()))
+            await asyncio.sleep(delay)
+
+    if text_parts:
+        text = "".join(text_parts)
+    else:
+        # No text deltas seen: fall back to the completed response object.
+        # getattr probes instead of try/except keep real bugs visible and
+        # skip exception construction on the common path.
+        text = getattr(response, "output_text", None)
+        if not text:
+            text = "\n".join(
+                t
+                for item in getattr(response, "output", None) or ()
+                for content in getattr(item, "content", None) or ()
+                if (t := getattr(content, "text", None))
+            )
+        if not text:
             # As a last resort, just dump the raw response
             return {"_raw_text": str(response)}
-        text = "\n".join(parts)
 
     # Try to parse JSON; if it fails, return raw text instead of crashing
     try:
-        json_str = extract_json_block(text)
-        data = json.loads(json_str)
-        return data
+        # Structured output (and well-behaved models) return pure JSON;
+        # only fall back to brace extraction when prose surrounds it.
+        try:
+            data = json_loads(strip_code_fence(text))
+        except Exception:
+            data = json_loads(extract_json_block(text))
     except Exception:
         return {"_raw_text": text}
 
+    dedupe_source_urls(data)
+    if cache_key:
+        cache.set(cache_key, json_dumps(data))
+    return data
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False, persist="disk")
+def fetch_model_answer(
+    prompt: Tuple[str, str],
+    cache_key: Optional[str] = None,
+    _on_delta: Optional[Any] = None,
+    _schema: Optional[Dict[str, Any]] = None,
+    _refresh: bool = False,
+) -> Dict[str, Any]:
+    """
+    In-process memoized front door for `call_model_with_web_search`.
+
+    Streamlit hashes (prompt, cache_key) and returns the stored dict on
+    repeat reruns without touching the network; the on-disk cache still
+    covers cross-process reuse. `_on_delta` and `_schema` are
+    underscore-prefixed so they stay out of the cache key (the schema is
+    implied by the prompt).
+    """
+    return run_async(
+        call_model_with_web_search(
+            prompt,
+            cache_key=cache_key,
+            on_delta=_on_delta,
+            schema=_schema,
+            refresh=_refresh,
+        )
+    )
+
+
+async def call_many(calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Run several model calls concurrently and return their results in order.
+
+    Each item in `calls` is a kwargs dict for `call_model_with_web_search`.
+    Lets prompt variants (e.g. one per level or region) share wall-clock
+    time instead of queueing behind each other; a semaphore bounds the
+    number in flight at once.
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+
+    async def guarded(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            return await call_model_with_web_search(**kwargs)
+
+    return await asyncio.gather(*(guarded(c) for c in calls))
+
+
+# BPM does not change for a given recording, so MusicBrainz answers can
+# be kept far longer than model answers.
+MUSICBRAINZ_TTL = 30 * 24 * 3600
+
+
+async def fetch_musicbrainz_profile(
+    song: str, artist: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Best-effort BPM lookup via the free MusicBrainz + AcousticBrainz APIs.
+
+    Runs concurrently with the model calls and costs ~100 ms, so a
+    well-known song gets an authoritative BPM essentially for free. Any
+    failure (network, no match, no AcousticBrainz data) returns None —
+    the model's own estimate is the fallback, never the other way round.
+    """
+    key = make_cache_key("musicbrainz", song, artist)
+    cached = cache.get(key, ttl=MUSICBRAINZ_TTL)
+    if cached is not None:
+        return json_loads(cached) or None
+
+    import httpx
+
+    query = f'recording:"{song}"'
+    if artist:
+        query += f' AND artist:"{artist}"'
+    try:
+        async with httpx.AsyncClient(
+            timeout=5.0,
+            headers={"User-Agent": "Boots2Beats/1.0 (line-dance finder)"},
+        ) as http:
+            resp = await http.get(
+                "https://musicbrainz.org/ws/2/recording/",
+                params={"query": query, "fmt": "json", "limit": 1},
+            )
+            resp.raise_for_status()
+            recordings = resp.json().get("recordings") or []
+            if not recordings:
+                # Negative result is authoritative: cache it so unknown
+                # songs do not trigger a lookup on every search.
+                cache.set(key, json_dumps({}))
+                return None
+            mbid = recordings[0]["id"]
+            resp = await http.get(
+                f"https://acousticbrainz.org/api/v1/{mbid}/low-level"
+            )
+            resp.raise_for_status()
+            bpm = (resp.json().get("rhythm") or {}).get("bpm")
+    except Exception:
+        # Transient failure: skip caching so the next search retries.
+        return None
+
+    profile = {"bpm": round(bpm)} if bpm else {}
+    cache.set(key, json_dumps(profile))
+    return profile or None
+
+
+# Generic tail the model often appends to one listing of a dance but not
+# another; dropped from the dedupe key so "Tennessee Whiskey" and
+# "Tennessee Whiskey Line Dance" collapse into one entry.
+_GENERIC_NAME_TAIL_RE = re.compile(r"\s+(?:line\s+)?dance$")
+
+
+def _canon_choreo_name(name: str) -> str:
+    canon = cache.normalize(name)
+    return _GENERIC_NAME_TAIL_RE.sub("", canon) or canon
+
+
+def dedupe_choreos(
+    choreos: List[Dict[str, Any]],
+    seen: Optional[set] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Drop repeated choreographies using a normalized (name, region) key.
+
+    O(n) with a hash set; doing this client-side is both cheaper and more
+    reliable than spending prompt tokens asking the model to deduplicate.
+    Pass the same `seen` set across groups to also drop cross-group repeats.
+    """
+    if seen is None:
+        seen = set()
+    out: List[Dict[str, Any]] = []
+    for ch in choreos:
+        key = (
+            _canon_choreo_name(str(ch.get("name", ""))),
+            cache.normalize(str(ch.get("estimated_region", ""))),
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(ch)
+    return out
+
+
+def split_combined_answer(
+    data: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split a combined one-call answer into the (dedicated, generic) pair
+    the rest of the pipeline and render path expect.
+    """
+    if not isinstance(data, dict) or data.get("_raw_text"):
+        return data, {}
+
+    dedicated = {
+        k: v
+        for k, v in data.items()
+        if k not in ("dedicated_choreographies", "compatible_choreographies")
+    }
+    dedicated["choreographies"] = data.get("dedicated_choreographies", []) or []
+    generic = {
+        "song": data.get("song"),
+        "artist": data.get("artist"),
+        "choreographies": data.get("compatible_choreographies", []) or [],
+    }
+    return dedicated, generic
+
+
+def merge_variant_answers(
+    answers: List[Dict[str, Any]], requested_level: str
+) -> Dict[str, Any]:
+    """
+    Merge per-variant answers into one result dict: first usable
+    song_info wins, choreographies are deduplicated on normalized
+    (name, region) and re-sorted by the model's rank.
+    """
+    merged: Dict[str, Any] = {}
+    collected: List[Dict[str, Any]] = []
+
+    for data in answers:
+        if not isinstance(data, dict) or data.get("_raw_text"):
+            continue
+        if not merged:
+            merged = {k: v for k, v in data.items() if k != "choreographies"}
+        if not merged.get("song_info") and data.get("song_info"):
+            merged["song_info"] = data["song_info"]
+        collected.extend(data.get("choreographies", []) or [])
+
+    deduped = dedupe_choreos(collected)
+    deduped.sort(
+        key=lambda ch: ch.get("rank") if isinstance(ch.get("rank"), int) else 999
+    )
+    merged["choreographies"] = deduped
+    merged["requested_level"] = requested_level
+    return merged
+
+
+# ============= RESULT TYPES ============= #
+
+class Choreo(TypedDict, total=False):
+    rank: int
+    name: str
+    estimated_level: str
+    estimated_region: str
+    type: str
+    fit_type: str
+    url: str
+    extra_sources: List[str]
+    reason: str
+
+
+class SongInfo(TypedDict, total=False):
+    title: str
+    artist: str
+    bpm: Any
+    tempo_label: str
+    style: str
+    time_signature: str
+    dance_feel: str
+    typical_dance_styles: List[str]
+    summary: str
+    sources: List[str]
+
+
+# Merged over each parsed dict once, so the renderers can index fields
+# directly instead of chaining .get() defaults.
+CHOREO_DEFAULTS: Dict[str, Any] = {
+    "rank": "?",
+    "name": "Unknown choreography",
+    "estimated_level": "Unknown",
+    "estimated_region": "Unknown",
+    "type": "other",
+    "fit_type": "unknown",
+    "url": None,
+    "extra_sources": [],
+    "reason": "",
+}
+
+SONG_INFO_DEFAULTS: Dict[str, Any] = {
+    "title": "",
+    "artist": "",
+    "bpm": None,
+    "tempo_label": "",
+    "style": "",
+    "time_signature": "",
+    "dance_feel": "",
+    "typical_dance_styles": [],
+    "summary": "",
+    "sources": [],
+}
+
 
 # ============= RENDER HELPERS ============= #
 
+def debug_enabled() -> bool:
+    """
+    True when the app runs with `?debug=1` in the URL.
+
+    The raw-JSON expanders mount a heavy JSON viewer widget and ship the
+    full response dict over the websocket on every search, so they are
+    opt-in rather than always-on.
+    """
+    return st.query_params.get("debug") == "1"
+
+
+def streaming_preview():
+    """
+    Return (on_delta, clear): `on_delta` shows the streamed model text in a
+    placeholder as it arrives, `clear` removes the placeholder afterwards.
+    """
+    placeholder = st.empty()
+
+    def on_delta(text: str) -> None:
+        placeholder.markdown(f"```\n{text[-1500:]}\n```")
+
+    return on_delta, placeholder.empty
+
+
 def render_choreo_group(title: str, dances: List[Dict[str, Any]]) -> None:
-    """Render a group of choreographies as mobile-friendly cards."""
+    """Render a group of choreographies as one Arrow-backed table."""
     if not dances:
         return
 
     st.markdown(f"### {title}")
 
-    for ch in dances:
-        rank = ch.get("rank", "?")
-        name = ch.get("name", "Unknown choreography")
-        level_str = ch.get("estimated_level", "Unknown")
-        region_str = ch.get("estimated_region", "Unknown")
-        type_str = ch.get("type", "other")
-        fit_type = ch.get("fit_type", "unknown")
-        url = ch.get("url")
-        extra_sources = ch.get("extra_sources", []) or []
-        reason = ch.get("reason", "")
-
-        with st.container():
-            st.markdown(f"**#{rank} – {name}**")
-
-            meta_line = (
-                f"Level: {level_str} · Region: {region_str} · "
-                f"Type: {type_str} · Fit: {fit_type}"
-            )
-            st.markdown(meta_line)
-
-            if url:
-                st.markdown(f"[Open choreography ↗]({url})")
-
-            if extra_sources:
-                first_extra = extra_sources[0]
-                st.markdown(f"[Extra source ↗]({first_extra})")
-
-            if reason:
-                st.markdown(f"> {reason}")
+    rows = []
+    for raw in dances:
+        ch: Choreo = {**CHOREO_DEFAULTS, **raw}
+        extra_sources = ch["extra_sources"] or []
+        rows.append(
+            {
+                "Rank": str(ch["rank"]),
+                "Name": ch["name"],
+                "Level": ch["estimated_level"],
+                "Region": ch["estimated_region"],
+                "Type": ch["type"],
+                "Link": ch["url"],
+                "Extra source": extra_sources[0] if extra_sources else None,
+                "Why": ch["reason"],
+            }
+        )
 
-            st.markdown("---")
+    # One Arrow table ships to the frontend in a single serialization
+    # pass, instead of ~7 markdown deltas per card.
+    st.dataframe(
+        pa.Table.from_pylist(rows),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Link": st.column_config.LinkColumn("Link"),
+            "Extra source": st.column_config.LinkColumn("Extra source"),
+        },
+    )
 
 
 def render_song_info(song_info: Dict[str, Any]) -> None:
@@ -314,23 +1203,21 @@ def render_song_info(song_info: Dict[str, Any]) -> None:
     if not song_info:
         return
 
-    title = song_info.get("title") or "Song info"
-    artist = song_info.get("artist") or ""
-    bpm = song_info.get("bpm")
-    tempo_label = song_info.get("tempo_label")
-    style = song_info.get("style")
-    time_sig = song_info.get("time_signature")
-    dance_feel = song_info.get("dance_feel")
-    typical_styles = song_info.get("typical_dance_styles") or []
-    summary = song_info.get("summary")
-    sources = song_info.get("sources") or []
-
-    st.markdown("### About this song")
+    info: SongInfo = {**SONG_INFO_DEFAULTS, **song_info}
+    title = info["title"] or "Song info"
+    artist = info["artist"]
+    bpm = info["bpm"]
+    tempo_label = info["tempo_label"]
+    style = info["style"]
+    time_sig = info["time_signature"]
+    dance_feel = info["dance_feel"]
+    typical_styles = info["typical_dance_styles"] or []
+    summary = info["summary"]
+    sources = info["sources"] or []
 
     header_line = f"**{title}**"
     if artist:
         header_line += f" – {artist}"
-    st.markdown(header_line)
 
     meta_parts: List[str] = []
     if bpm:
@@ -342,32 +1229,147 @@ def render_song_info(song_info: Dict[str, Any]) -> None:
     if time_sig:
         meta_parts.append(str(time_sig))
 
+    # One st.markdown call per card: each call is a separate message to
+    # the frontend, so the pieces are joined here instead.
+    parts: List[str] = ["### About this song", header_line]
     if meta_parts:
-        st.markdown(" · ".join(meta_parts))
-
+        parts.append(" · ".join(meta_parts))
     if dance_feel:
-        st.markdown(str(dance_feel))
-
+        parts.append(str(dance_feel))
     if typical_styles:
-        st.markdown(
+        parts.append(
             "Typical dance styles: " + ", ".join(str(x) for x in typical_styles)
         )
-
     if summary:
-        st.markdown(f"> {summary}")
-
+        parts.append(f"> {summary}")
     if sources:
-        first = sources[0]
-        st.markdown(f"[Source info ↗]({first})")
+        parts.append(f"[Source info ↗]({sources[0]})")
+    parts.append("---")
+
+    st.markdown("\n\n".join(parts))
+
+
+def render_batch_results(batch_data: Dict[str, Any], max_results: int) -> None:
+    """Render a batched multi-song answer."""
+    batch_raw_text = batch_data.get("_raw_text") if isinstance(batch_data, dict) else None
+    batch_results = batch_data.get("results", []) if isinstance(batch_data, dict) else []
+
+    if batch_raw_text:
+        st.markdown("### Raw model answer")
+        st.markdown(batch_raw_text)
+    elif not batch_results:
+        st.info("No suitable choreographies found (or the model could not identify any).")
+    else:
+        for entry in batch_results:
+            entry_song = entry.get("song", "Unknown song")
+            render_song_info(entry.get("song_info", {}) or {})
+            render_choreo_group(
+                f'Dances for "{entry_song}"',
+                (entry.get("choreographies") or [])[:max_results],
+            )
+
+    if debug_enabled():
+        with st.expander("Model output – batch (raw)"):
+            if batch_raw_text:
+                st.text(batch_raw_text)
+            else:
+                st.json(batch_data)
+
+
+def render_single_results(
+    dedicated_data: Dict[str, Any],
+    generic_data: Dict[str, Any],
+    max_results: int,
+) -> None:
+    """Render the two-part single-song answer."""
+    dedicated_raw_text = dedicated_data.get("_raw_text") if isinstance(dedicated_data, dict) else None
+    if dedicated_raw_text:
+        song_info = {}
+        dedicated_choreos: List[Dict[str, Any]] = []
+    else:
+        song_info = dedicated_data.get("song_info", {}) if isinstance(dedicated_data, dict) else {}
+        dedicated_choreos = dedicated_data.get("choreographies", []) if isinstance(dedicated_data, dict) else []
+
+    generic_raw_text = generic_data.get("_raw_text") if isinstance(generic_data, dict) else None
+    if generic_raw_text:
+        generic_choreos: List[Dict[str, Any]] = []
+    else:
+        generic_choreos = generic_data.get("choreographies", []) if isinstance(generic_data, dict) else []
+
+    # Render song info if we have structured data
+    if song_info:
+        render_song_info(song_info)
+
+    st.subheader("Top matches")
+
+    # Deduplicate within and across the two groups, then enforce the
+    # caps from the slider
+    seen_choreos: set = set()
+    if dedicated_choreos:
+        dedicated_choreos = dedupe_choreos(dedicated_choreos, seen_choreos)[:max_results]
+    if generic_choreos:
+        generic_choreos = dedupe_choreos(generic_choreos, seen_choreos)[:max_results]
+
+    # Dedupe and capping leave gaps in the model's ranks; renumber each
+    # group 1..N so the table reads cleanly.
+    for group in (dedicated_choreos, generic_choreos):
+        for i, ch in enumerate(group, 1):
+            ch["rank"] = i
+
+    # Render structured results as cards
+    if dedicated_choreos:
+        render_choreo_group("Dances choreographed for this song", dedicated_choreos)
+    if generic_choreos:
+        render_choreo_group("Musical matches from other songs", generic_choreos)
+
+    # If a call returned only raw text, show it as-is
+    if dedicated_raw_text:
+        st.markdown("### Dances choreographed for this song (raw model answer)")
+        st.markdown(dedicated_raw_text)
+
+    if generic_raw_text:
+        st.markdown("### Musical matches from other songs (raw model answer)")
+        st.markdown(generic_raw_text)
+
+    if (
+        not dedicated_choreos
+        and not generic_choreos
+        and not dedicated_raw_text
+        and not generic_raw_text
+    ):
+        st.info("No suitable choreographies found (or the model could not identify any).")
+
+    # Raw output for debugging in expanders (opt-in via ?debug=1)
+    if debug_enabled():
+        with st.expander("Model output – dedicated group (raw)"):
+            if dedicated_raw_text:
+                st.text(dedicated_raw_text)
+            else:
+                st.json(dedicated_data)
 
-    st.markdown("---")
+        with st.expander("Model output – musical matches group (raw)"):
+            if generic_raw_text:
+                st.text(generic_raw_text)
+            else:
+                st.json(generic_data)
 
 
 # ============= STREAMLIT UI ============= #
 
+@st.cache_resource
+def logo_bytes() -> Optional[bytes]:
+    """Read the logo once per process; reruns skip the stat + decode."""
+    try:
+        with open("logo.png", "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
 # Logo + title
-if os.path.exists("logo.png"):
-    st.image("logo.png", width=220)
+_logo = logo_bytes()
+if _logo:
+    st.image(_logo, width=220)
 
 st.title("Boots to Beats")
 st.write(
@@ -378,21 +1380,45 @@ st.write(
 
 # --- Input widgets ---
 
-song_title = st.text_input("Song title", value="Texas Hold 'Em")
-artist = st.text_input("Artist (optional)", value="Beyoncé")
+# Inside a form, edits buffer client-side and only the submit button
+# triggers a script rerun — typing in the text inputs no longer reruns
+# the whole script on every keystroke.
+with st.form("query"):
+    song_title = st.text_input(
+        "Song title",
+        value="Texas Hold 'Em",
+        help='Separate several songs with ";" to look them all up in one request '
+        "(the artist field is ignored for multi-song lookups).",
+    )
+    artist = st.text_input("Artist (optional)", value="Beyoncé")
 
-level = st.selectbox(
-    "Desired level",
-    ["Beginner", "High Beginner", "Improver", "Intermediate", "Advanced", "Any"],
-    index=0,
-)
+    level = st.selectbox(
+        "Desired level",
+        ["Beginner", "High Beginner", "Improver", "Intermediate", "Advanced", "Any"],
+        index=0,
+    )
 
-region_choice = st.selectbox(
-    "Region (hint for the model)",
-    ["Global", "EU", "US", "UK", "Other"],
-    index=1,
-)
-region_other = st.text_input("If 'Other', specify region (optional)")
+    region_choice = st.selectbox(
+        "Region (hint for the model)",
+        ["Global", "EU", "US", "UK", "Other"],
+        index=1,
+    )
+    region_other = st.text_input("If 'Other', specify region (optional)")
+
+    max_results = st.slider(
+        "Choreographies per group",
+        min_value=1,
+        max_value=5,
+        value=3,
+    )
+
+    force_refresh = st.checkbox(
+        "Force refresh",
+        value=False,
+        help="Skip cached answers and ask the model again.",
+    )
+
+    run_search = st.form_submit_button("Find choreographies")
 
 if region_choice == "Other" and region_other.strip():
     region_value: Optional[str] = region_other.strip()
@@ -401,108 +1427,163 @@ elif region_choice == "Global":
 else:
     region_value = region_choice
 
-max_results = st.slider(
-    "Choreographies per group",
-    min_value=1,
-    max_value=5,
-    value=3,
-)
-
-run_search = st.button("Find choreographies")
-
 # --- Run search when button clicked ---
 
 if run_search:
-    if not song_title.strip():
+    if force_refresh:
+        # Drop the in-process memo; the disk layer is bypassed per-call
+        # via refresh=True below.
+        fetch_model_answer.clear()
+    songs = [s.strip() for s in song_title.split(";") if s.strip()]
+    if not songs:
         st.error("Please enter a song title.")
+    elif len(songs) > 1:
+        # Batched lookup: one API call (and one instruction block's worth
+        # of input tokens) covers all songs.
+        with st.spinner(f"Looking up {len(songs)} songs in one request..."):
+            on_delta, clear_preview = streaming_preview()
+            batch_data = fetch_model_answer(
+                build_prompt_batch(tuple(songs), level, region_value, max_results),
+                cache_key=make_cache_key(
+                    "batch", *songs, level, region_value, max_results
+                ),
+                _on_delta=on_delta,
+                _schema=_BATCH_SCHEMA,
+                _refresh=force_refresh,
+            )
+            clear_preview()
+
+        st.session_state["last_results"] = {
+            "mode": "batch",
+            "batch": batch_data,
+            "max_results": max_results,
+        }
     else:
-        song_clean = song_title.strip()
+        song_clean = songs[0]
         artist_clean = artist.strip() or None
 
-        # PART 1 – Dedicated choreographies + song_info
-        with st.spinner("Finding choreographies dedicated to this song..."):
-            dedicated_data = call_model_with_web_search(
-                build_prompt_dedicated(
-                    song_title=song_clean,
-                    artist=artist_clean,
-                    level=level,
-                    region=region_value,
-                    max_results=max_results,
-                )
-            )
+        # Both result groups are pure network waits on OpenAI. The default
+        # pipeline asks for them in ONE combined request (one round-trip,
+        # one web_search warm-up); the legacy flag issues the old separate
+        # PART 1 / PART 2 calls concurrently instead, with PART 2 using
+        # the cached song profile (if any) rather than waiting for PART 1.
+        # song_info depends only on the song itself, so it is cached under
+        # (title, artist) alone — a retry with a different level or region
+        # reuses the tempo/style analysis instead of redoing it blind.
+        song_info_key = make_cache_key("song_info", song_clean, artist_clean)
+        cached_song_info = cache.get(song_info_key)
+        known_profile = summarize_song_info(
+            json_loads(cached_song_info) if cached_song_info else None
+        )
 
-        # Determine if we got structured JSON or just raw text
-        dedicated_raw_text = dedicated_data.get("_raw_text") if isinstance(dedicated_data, dict) else None
-        if dedicated_raw_text:
-            song_info = {}
-            dedicated_choreos: List[Dict[str, Any]] = []
-        else:
-            song_info = dedicated_data.get("song_info", {}) if isinstance(dedicated_data, dict) else {}
-            dedicated_choreos = dedicated_data.get("choreographies", []) if isinstance(dedicated_data, dict) else []
-
-        # PART 2 – Musical matches from other songs
-        with st.spinner("Finding musical matches from other songs..."):
-            generic_data = call_model_with_web_search(
-                build_prompt_generic(
-                    song_title=song_clean,
-                    artist=artist_clean,
-                    level=level,
-                    region=region_value,
-                    max_results=max_results,
-                    song_info=song_info,
+        with st.spinner("Finding dedicated dances and musical matches..."):
+            levels = CONCRETE_LEVELS if level == "Any" else [level]
+            on_delta, clear_preview = streaming_preview()
+            calls: List[Dict[str, Any]] = []
+            if TWO_CALL_PIPELINE:
+                for lv in levels:
+                    calls.append(
+                        {
+                            "prompt": build_prompt_dedicated(
+                                song_clean, artist_clean, lv, region_value, max_results
+                            ),
+                            "cache_key": make_cache_key(
+                                "dedicated", song_clean, artist_clean, lv, region_value, max_results
+                            ),
+                            "schema": _DEDICATED_SCHEMA,
+                            "refresh": force_refresh,
+                            # Preview only the first stream; concurrent
+                            # streams would interleave unreadably.
+                            "on_delta": on_delta if lv == levels[0] else None,
+                        }
+                    )
+                for lv in levels:
+                    calls.append(
+                        {
+                            "prompt": build_prompt_generic(
+                                song_clean, artist_clean, lv, region_value,
+                                max_results, known_profile,
+                            ),
+                            "cache_key": make_cache_key(
+                                "generic", song_clean, artist_clean, lv, region_value, max_results
+                            ),
+                            "schema": _GENERIC_SCHEMA,
+                            "refresh": force_refresh,
+                        }
+                    )
+            else:
+                for lv in levels:
+                    calls.append(
+                        {
+                            "prompt": build_prompt_combined(
+                                song_clean, artist_clean, lv, region_value, max_results
+                            ),
+                            "cache_key": make_cache_key(
+                                "combined", song_clean, artist_clean, lv, region_value, max_results
+                            ),
+                            "schema": _COMBINED_SCHEMA,
+                            "refresh": force_refresh,
+                            "on_delta": on_delta if lv == levels[0] else None,
+                        }
+                    )
+
+            async def run_with_bpm_lookup():
+                # The free BPM lookup overlaps with the (much slower)
+                # model calls, so it adds no wall-clock time.
+                return await asyncio.gather(
+                    call_many(calls),
+                    fetch_musicbrainz_profile(song_clean, artist_clean),
                 )
-            )
 
-        generic_raw_text = generic_data.get("_raw_text") if isinstance(generic_data, dict) else None
-        if generic_raw_text:
-            generic_choreos: List[Dict[str, Any]] = []
-        else:
-            generic_choreos = generic_data.get("choreographies", []) if isinstance(generic_data, dict) else []
-
-        # Render song info if we have structured data
-        if song_info:
-            render_song_info(song_info)
-
-        st.subheader("Top matches")
-
-        # Enforce caps from slider for structured lists
-        if dedicated_choreos:
-            dedicated_choreos = dedicated_choreos[:max_results]
-        if generic_choreos:
-            generic_choreos = generic_choreos[:max_results]
-
-        # Render structured results as cards
-        if dedicated_choreos:
-            render_choreo_group("Dances choreographed for this song", dedicated_choreos)
-        if generic_choreos:
-            render_choreo_group("Musical matches from other songs", generic_choreos)
-
-        # If a call returned only raw text, show it as-is
-        if dedicated_raw_text:
-            st.markdown("### Dances choreographed for this song (raw model answer)")
-            st.markdown(dedicated_raw_text)
-
-        if generic_raw_text:
-            st.markdown("### Musical matches from other songs (raw model answer)")
-            st.markdown(generic_raw_text)
-
-        if (
-            not dedicated_choreos
-            and not generic_choreos
-            and not dedicated_raw_text
-            and not generic_raw_text
-        ):
-            st.info("No suitable choreographies found (or the model could not identify any).")
-
-        # Raw output for debugging in expanders
-        with st.expander("Model output – dedicated group (raw)"):
-            if dedicated_raw_text:
-                st.text(dedicated_raw_text)
-            else:
-                st.json(dedicated_data)
+            answers, mb_profile = run_async(run_with_bpm_lookup())
+            clear_preview()
 
-        with st.expander("Model output – musical matches group (raw)"):
-            if generic_raw_text:
-                st.text(generic_raw_text)
+            if TWO_CALL_PIPELINE:
+                k = len(levels)
+                if level == "Any":
+                    dedicated_data = merge_variant_answers(answers[:k], "Any")
+                    generic_data = merge_variant_answers(answers[k:], "Any")
+                else:
+                    dedicated_data, generic_data = answers
             else:
-                st.json(generic_data)
+                pairs = [split_combined_answer(a) for a in answers]
+                if level == "Any":
+                    dedicated_data = merge_variant_answers([p[0] for p in pairs], "Any")
+                    generic_data = merge_variant_answers([p[1] for p in pairs], "Any")
+                else:
+                    dedicated_data, generic_data = pairs[0]
+
+        if isinstance(dedicated_data, dict) and dedicated_data.get("song_info"):
+            # An authoritative MusicBrainz BPM beats the model's estimate.
+            if mb_profile and mb_profile.get("bpm"):
+                dedicated_data["song_info"]["bpm"] = mb_profile["bpm"]
+            cache.set(song_info_key, json_dumps(dedicated_data["song_info"]))
+
+        st.session_state["last_results"] = {
+            "mode": "single",
+            "dedicated": dedicated_data,
+            "generic": generic_data,
+            "max_results": max_results,
+        }
+
+@st.fragment
+def results_section() -> None:
+    """
+    Render the latest results from session state. As a fragment,
+    interactions inside it (e.g. toggling the raw-output expanders)
+    rerun only this subtree instead of the whole script.
+    """
+    last_results = st.session_state.get("last_results")
+    if not last_results:
+        return
+    if last_results["mode"] == "batch":
+        render_batch_results(last_results["batch"], last_results["max_results"])
+    else:
+        render_single_results(
+            last_results["dedicated"],
+            last_results["generic"],
+            last_results["max_results"],
+        )
+
+
+results_section()
@@ -0,0 +1,77 @@
+"""
+Tiny persistent key/value cache for model responses.
+
+Backed by a single-table SQLite database (stdlib only) so that repeat
+queries skip the multi-second — and paid — OpenAI round-trip entirely.
+Values are stored as JSON strings; expiry is checked on read.
+"""
+
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Optional
+
+_DB_PATH = os.getenv("B2B_CACHE_PATH", ".b2b_cache.sqlite3")
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, ts INTEGER)"
+
+# Cached model answers stay useful for a while; choreography catalogues
+# do not change hour to hour.
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def normalize(s: str) -> str:
+    """
+    Fold a free-text field into a canonical cache-key form: strip
+    diacritics, lowercase, drop punctuation, collapse whitespace.
+
+    "Texas Hold 'Em", "texas hold em" and "Texas Hold'em" all map to
+    the same key, so trivial spelling variants become cache hits.
+    """
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
+    return re.sub(r"[^\w]+", " ", s).strip().lower()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(_DB_PATH)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def get(key: str, ttl: int = DEFAULT_TTL) -> Optional[str]:
+    """Return the cached value for `key`, or None if absent or expired.
+
+    A broken cache (read-only filesystem, corrupt or locked database)
+    degrades to a miss instead of taking the search down.
+    """
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT value, ts FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    value, ts = row
+    if time.time() - ts > ttl:
+        return None
+    return value
+
+
+def set(key: str, value: str) -> None:
+    """Store `value` under `key`, replacing any previous entry.
+
+    Write failures are swallowed: losing a cache entry is always better
+    than failing the request that produced it.
+    """
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)",
+                (key, value, int(time.time())),
+            )
+    except sqlite3.Error:
+        pass